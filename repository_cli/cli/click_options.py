@@ -7,10 +7,17 @@
 
 """Commonly used options for CLI commands."""
 
+from functools import lru_cache
+
 import click
 
+# the factories are cached, decorating several commands with the same
+# options then reuses one decorator instead of building a new one each time.
+# this is safe as click creates a new Option whenever a decorator is applied.
+
 
 # -i '{ "identifier": "10.48436/fcze8-4vx33", "scheme": "doi"}'
+@lru_cache(maxsize=4)
 def option_identifier(required: bool = False):
     """Get parameter options for metadata identifier."""
     return click.option(
@@ -24,6 +31,7 @@ def option_identifier(required: bool = False):
 # --pid-identifier ' { "doi":
 #   { "identifier": "10.48436/fcze8-4vx33", "provider": "unmanaged" }
 # }'
+@lru_cache(maxsize=4)
 def option_pid_identifier(required: bool = False):
     """Get parameter options for metadata identifier."""
     return click.option(
@@ -36,6 +44,7 @@ def option_pid_identifier(required: bool = False):
 
 
 # -p "fcze8-4vx33"
+@lru_cache(maxsize=4)
 def option_pid(required: bool = False):
     """Get parameter options for record PID."""
     return click.option(
@@ -48,6 +57,7 @@ def option_pid(required: bool = False):
 
 
 # --if "input.json"
+@lru_cache(maxsize=4)
 def option_input_file(required: bool = False):
     """Get parameter options for input file."""
     return click.option(
@@ -62,6 +72,7 @@ def option_input_file(required: bool = False):
 
 
 # --of "output.json"
+@lru_cache(maxsize=4)
 def option_output_file(required: bool = False):
     """Get parameter options for output file."""
     return click.option(
@@ -71,5 +82,48 @@ def option_output_file(required: bool = False):
         metavar="string",
         required=required,
         help="name of file to write to",
-        type=click.File("w"),
+        type=click.File("wb"),
+    )
+
+
+# --workers 4
+@lru_cache(maxsize=4)
+def option_workers(required: bool = False):
+    """Get parameter options for number of parallel workers."""
+    return click.option(
+        "--workers",
+        "-w",
+        metavar="integer",
+        required=required,
+        default=1,
+        show_default=True,
+        help="number of records to process in parallel",
+        type=click.IntRange(min=1),
+    )
+
+
+# --pretty / --compact
+@lru_cache(maxsize=4)
+def option_pretty(required: bool = False):
+    """Get parameter options for JSON indentation."""
+    return click.option(
+        "--pretty/--compact",
+        default=None,
+        required=required,
+        help="indent JSON output [default: pretty on terminals, else compact]",
+    )
+
+
+# --format ndjson
+@lru_cache(maxsize=4)
+def option_output_format(required: bool = False):
+    """Get parameter options for output format."""
+    return click.option(
+        "--format",
+        "output_format",
+        required=required,
+        default="json",
+        show_default=True,
+        help="write a JSON array or compact JSON lines (one record per line)",
+        type=click.Choice(["json", "ndjson"]),
     )
@@ -8,19 +8,100 @@
 """Management commands for records."""
 
 import json
-from typing import TextIO
+import os
+from concurrent.futures import ThreadPoolExecutor
+from itertools import cycle, islice, repeat
+from typing import BinaryIO, Iterable, TextIO
 
 import click
+from flask import current_app
 from flask.cli import with_appcontext
-from flask_principal import Identity
-from invenio_rdm_records.records.models import RDMRecordMetadata
-from invenio_records import Record
 
 from .click_options import (option_identifier, option_input_file,
-                            option_output_file, option_pid,
-                            option_pid_identifier)
-from .util import (get_draft, get_identity, get_records_service, record_exists,
-                   update_record)
+                            option_output_file, option_output_format,
+                            option_pid, option_pid_identifier, option_pretty,
+                            option_workers)
+
+try:
+    import ijson
+except ImportError:  # pragma: no cover
+    ijson = None
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# records are collected in a buffer which is written once it exceeds 1 MiB
+_OUTPUT_BUFFER_SIZE = 1 << 20
+
+# console output is echoed in chunks of about 64 KiB
+_CONSOLE_BUFFER_SIZE = 64 << 10
+
+# input files from 64 MiB on are parsed incrementally, if ijson is installed
+_STREAM_INPUT_SIZE = 64 << 20
+
+_JSON_ERRORS = (json.JSONDecodeError,) + ((ijson.JSONError,) if ijson else ())
+
+# NOTE: invenio modules (and ``.util``, which pulls them in) are imported
+# inside the commands, so that ``--help`` and shell completion don't pay for
+# loading the whole invenio import graph.
+
+
+def _loads(value: str):
+    """Deserialize a JSON string, with orjson if it is installed.
+
+    Both raise a subclass of json.JSONDecodeError for invalid input.
+    """
+    if orjson:
+        return orjson.loads(value)
+    return json.loads(value)
+
+
+def _load_records(input_file: TextIO) -> Iterable[dict]:
+    """Load the records of a file containing a JSON array.
+
+    Large files are parsed incrementally with ijson (if installed), so that
+    only the records currently processed are held in memory. In that case
+    invalid JSON is only detected while iterating.
+    """
+    try:
+        size = os.fstat(input_file.fileno()).st_size
+    except OSError:
+        size = 0
+
+    if ijson and size >= _STREAM_INPUT_SIZE:
+        stream = getattr(input_file, "buffer", input_file)
+        return ijson.items(stream, "item", use_float=True)
+    return _loads(input_file.read())
+
+
+def _batched(iterable: Iterable, size: int):
+    """Yield lists of up to size consecutive items of iterable."""
+    iterator = iter(iterable)
+    batch = list(islice(iterator, size))
+    while batch:
+        yield batch
+        batch = list(islice(iterator, size))
+
+
+def _dumpb(obj, pretty: bool = True) -> bytes:
+    """Serialize obj to indented or compact UTF-8 encoded JSON.
+
+    orjson is used if it is installed, it is considerably faster than the
+    json module of the standard library.
+    """
+    if orjson:
+        option = orjson.OPT_INDENT_2 if pretty else None
+        return orjson.dumps(obj, option=option)
+    if pretty:
+        return json.dumps(obj, indent=2).encode()
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+def _dumps(obj, pretty: bool = True) -> str:
+    """Serialize obj to an indented or compact JSON string."""
+    return _dumpb(obj, pretty).decode()
 
 
 @click.group()
@@ -36,59 +117,117 @@ def count_records():
     example call:
         invenio repository rdmrecords count
     """
-    records = RDMRecordMetadata.query.filter_by(is_deleted=False)
-    num_records = records.count()
+    from invenio_db import db
+    from invenio_rdm_records.records.models import RDMRecordMetadata
+    from sqlalchemy import func
+
+    # Query.count() wraps the whole query in a subquery, select the count
+    # directly instead
+    num_records = (
+        db.session.query(func.count(RDMRecordMetadata.id))
+        .filter(RDMRecordMetadata.is_deleted.is_(False))
+        .scalar()
+    )
     click.secho(f"{num_records} records", fg="green")
 
 
 @rdmrecords.command("list")
 @option_output_file()
+@option_output_format()
+@option_pretty()
 @with_appcontext
-def list_records(output_file: TextIO):
+def list_records(output_file: BinaryIO, output_format: str, pretty: bool):
     """List record's.
 
+    With --format ndjson every record is written compact on its own line
+    (JSON lines), which can be processed as a stream, e.g. with jq -c.
+    --pretty can not be combined with it.
+
     example call:
-        invenio repository rdmrecords list [--of out.json]
+        invenio repository rdmrecords list [--of out.json] [--pretty]
+        [--format ndjson]
     """
-    records = RDMRecordMetadata.query.filter_by(is_deleted=False)
-    if output_file:
-        output_file.write("[")
+    ndjson = output_format == "ndjson"
+    if ndjson and pretty:
+        raise click.UsageError("--pretty can not be used with --format ndjson")
+
+    from invenio_rdm_records.records.models import RDMRecordMetadata
+
+    # stream_results makes the driver use a server side cursor (e.g. with
+    # psycopg2), so not even the driver buffers the whole result set
+    records = (
+        RDMRecordMetadata.query.filter_by(is_deleted=False)
+        .execution_options(stream_results=True)
+        .yield_per(1000)
+    )
+    if ndjson:
+        pretty = False
+    elif pretty is None:
+        pretty = output_file is None or output_file.isatty()
 
-    num_records = records.count()
+    buffer = bytearray() if ndjson else bytearray(b"[")
+    colors = cycle(("blue", "cyan"))
+    lines = []
+    lines_size = 0
+    num_records = 0
 
     # rather iterate and write one record at time instead of converting to list
-    # (might take up much memory)
-    for index, metadata in enumerate(records):
+    # (might take up much memory). the separator is written before every
+    # record but the first, so there is no need for an extra COUNT query.
+    for metadata in records:
         if output_file:
-            json.dump(metadata.json, output_file, indent=2)
-            if index < (num_records - 1):
-                output_file.write(",\n")
+            if num_records > 0 and not ndjson:
+                buffer += b",\n"
+            buffer += _dumpb(metadata.json, pretty)
+            if ndjson:
+                buffer += b"\n"
+            if len(buffer) >= _OUTPUT_BUFFER_SIZE:
+                output_file.write(buffer)
+                buffer.clear()
         else:
-            fg = "blue" if index % 2 == 0 else "cyan"
-            click.secho(json.dumps(metadata.json, indent=2), fg=fg)
+            line = click.style(_dumps(metadata.json, pretty), fg=next(colors))
+            lines.append(line)
+            lines_size += len(line)
+            if lines_size >= _CONSOLE_BUFFER_SIZE:
+                click.echo("\n".join(lines))
+                lines.clear()
+                lines_size = 0
+        num_records += 1
 
     if output_file:
-        output_file.write("]")
+        if not ndjson:
+            buffer += b"]"
+        output_file.write(buffer)
 
         click.secho(
             f"wrote {num_records} records to {output_file.name}", fg="green"
         )
     else:
+        if lines:
+            click.echo("\n".join(lines))
         click.secho(f"{num_records} records", fg="green")
 
 
 @rdmrecords.command("update")
 @option_input_file(required=True)
+@option_workers()
 @with_appcontext
-def update_records(input_file: TextIO):
+def update_records(input_file: TextIO, workers: int):
     """Update records specified in input file.
 
+    Records are independent of each other, with --workers > 1 they are
+    updated in parallel, each worker thread in its own app context. The
+    input is processed in batches of 500 records.
+
     example call:
-        invenio repository rdmrecords update --if in.json
+        invenio repository rdmrecords update --if in.json [--workers 4]
     """
+    from .util import (get_existing_pids, get_identity, get_records_service,
+                       update_record)
+
     try:
-        records = json.load(input_file)
-    except Exception as e:
+        records = _load_records(input_file)
+    except json.JSONDecodeError as e:
         click.secho(e.msg, fg="red")
         click.secho(f"The input file is not a valid JSON File", fg="red")
         return
@@ -97,24 +236,50 @@ def update_records(input_file: TextIO):
         permission_name="system_process", role_name="admin"
     )
     service = get_records_service()
+    app = current_app._get_current_object()
 
-    for record in records:
+    def update(record, existing_pids):
+        """Update record and return the result message and its color."""
         pid = record["id"]
-        click.secho(f"\n'{pid}', trying to update", fg="yellow")
-        if not record_exists(pid):
-            click.secho(f"'{pid}', does not exist or is deleted", fg="red")
-            continue
+        if pid not in existing_pids:
+            return f"'{pid}', does not exist or is deleted", "red"
 
-        old_data = service.read(id_=pid, identity=identity).data.copy()
         try:
+            old_data = service.read(id_=pid, identity=identity).data
             update_record(
-                pid=pid, identity=identity, new_data=record, old_data=old_data
+                pid=pid,
+                identity=identity,
+                new_data=record,
+                old_data=old_data,
+                service=service,
             )
         except Exception as e:
-            click.secho(f"'{pid}', problem during update, {e}", fg="red")
-            continue
+            return f"'{pid}', problem during update, {e}", "red"
 
-        click.secho(f"'{pid}', successfully updated", fg="green")
+        return f"'{pid}', successfully updated", "green"
+
+    def update_in_app_context(record, existing_pids):
+        with app.app_context():
+            return update(record, existing_pids)
+
+    try:
+        # threads are only started on submit, with a single worker the
+        # records are updated in the current thread and app context
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for batch in _batched(records, 500):
+                existing_pids = get_existing_pids([r["id"] for r in batch])
+                args = (batch, repeat(existing_pids))
+                if workers == 1:
+                    results = map(update, *args)
+                else:
+                    results = executor.map(update_in_app_context, *args)
+
+                for message, fg in results:
+                    click.secho(message, fg=fg)
+    except _JSON_ERRORS as e:
+        # only raised here if the input file is parsed incrementally
+        click.secho(str(e), fg="red")
+        click.secho(f"The input file is not a valid JSON File", fg="red")
 
 
 @rdmrecords.command("delete")
@@ -126,15 +291,19 @@ def delete_record(pid: str):
     example call:
         invenio repository rdmrecords delete -p "fcze8-4vx33"
     """
-    if not record_exists(pid):
-        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
-        return
+    from .util import (RECORD_NOT_FOUND_ERRORS, get_identity,
+                       get_records_service)
 
     identity = get_identity(
         permission_name="system_process", role_name="admin"
     )
     service = get_records_service()
-    service.delete(id_=pid, identity=identity)
+    try:
+        service.delete(id_=pid, identity=identity)
+    except RECORD_NOT_FOUND_ERRORS:
+        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
+        return
+
     click.secho(f"'{pid}', soft-deleted", fg="green")
 
 
@@ -152,23 +321,31 @@ def list_pids(pid: str):
     example call:
         invenio repository rdmrecords pids list -p <pid>
     """
-    if not record_exists(pid):
+    from invenio_records_resources.services.errors import \
+        PermissionDeniedError
+
+    from .util import get_identity, get_record_data
+
+    try:
+        record_data = get_record_data(pid, identity=get_identity())
+    except PermissionDeniedError:
+        click.secho(f"'{pid}', is restricted", fg="red")
+        return
+
+    if record_data is None:
         click.secho(f"'{pid}', does not exist or is deleted", fg="red")
         return
 
-    identity = get_identity()
-    service = get_records_service()
-    record_data = service.read(id_=pid, identity=identity).data.copy()
-    current_pids = record_data.get("pids", {}).items()
+    current_pids = record_data.get("pids") or {}
 
-    if len(current_pids) == 0:
+    if not current_pids:
         fg = "yellow"
         click.secho("record does not have any pids", fg=fg)
 
-    for index, pid in enumerate(current_pids):
-        # BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET
-        fg = "blue" if index % 2 == 0 else "cyan"
-        click.secho(json.dumps(pid, indent=2), fg=fg)
+    # BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET
+    colors = cycle(("blue", "cyan"))
+    for pid in current_pids.items():
+        click.secho(_dumps(pid), fg=next(colors))
 
 
 @pids.command("replace")
@@ -183,26 +360,29 @@ def replace_pid(pid: str, pid_identifier: str):
         --pid-identifier ' { "doi": {
         "identifier": "10.48436/fcze8-4vx33", "provider": "unmanaged" }}'
     """
+    from .util import get_identity, get_record_data, update_record
+
     try:
-        pid_identifier_json = json.loads(pid_identifier)
-    except Exception as e:
+        pid_identifier_json = _loads(pid_identifier)
+    except json.JSONDecodeError as e:
         click.secho(e.msg, fg="red")
         click.secho(f"pid_identifier is not valid JSON", fg="red")
         return
 
-    if not record_exists(pid):
-        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
+    if not isinstance(pid_identifier_json, dict) or not pid_identifier_json:
+        click.secho("pid_identifier has to be a non empty object", fg="red")
         return
 
     identity = get_identity(
         permission_name="system_process", role_name="admin"
     )
-    service = get_records_service()
+    old_data = get_record_data(pid, identity=identity)
+    if old_data is None:
+        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
+        return
 
-    old_data = service.read(id_=pid, identity=identity).data.copy()
-    new_data = old_data.copy()
-    pids = new_data.get("pids", {})
-    pid_key = list(pid_identifier_json.keys())[0]
+    pids = old_data.get("pids", {})
+    pid_key = next(iter(pid_identifier_json))
 
     if pids.get(pid_key, None) is None:
         click.secho(
@@ -210,8 +390,10 @@ def replace_pid(pid: str, pid_identifier: str):
         )
         return
 
-    pids[pid_key] = pid_identifier_json.get(pid_key)
-    new_data["pids"] = pids
+    # build the new data without modifying old_data, unchanged parts are
+    # shared between both
+    new_pids = {**pids, pid_key: pid_identifier_json[pid_key]}
+    new_data = {**old_data, "pids": new_pids}
 
     try:
         update_record(
@@ -230,7 +412,7 @@ def identifiers():
 
 
 @identifiers.command("list")
-@option_pid(required=option_pid)
+@option_pid(required=True)
 @with_appcontext
 def list_identifiers(pid: str):
     """List record's identifiers.
@@ -238,23 +420,31 @@ def list_identifiers(pid: str):
     example call:
         invenio repository rdmrecords identifiers list -p <pid>
     """
-    if not record_exists(pid):
+    from invenio_records_resources.services.errors import \
+        PermissionDeniedError
+
+    from .util import get_identity, get_record_data
+
+    try:
+        record_data = get_record_data(pid, identity=get_identity())
+    except PermissionDeniedError:
+        click.secho(f"'{pid}', is restricted", fg="red")
+        return
+
+    if record_data is None:
         click.secho(f"'{pid}', does not exist or is deleted", fg="red")
         return
 
-    identity = get_identity()
-    service = get_records_service()
-    record_data = service.read(id_=pid, identity=identity).data.copy()
     current_identifiers = record_data["metadata"].get("identifiers", [])
 
-    if len(current_identifiers) == 0:
+    if not current_identifiers:
         fg = "yellow"
         click.secho("record does not have any identifiers", fg=fg)
 
-    for index, identifier in enumerate(current_identifiers):
-        # BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET
-        fg = "blue" if index % 2 == 0 else "cyan"
-        click.secho(json.dumps(identifier, indent=2), fg=fg)
+    # BLACK, RED, GREEN, YELLOW, BLUE, MAGENTA, CYAN, WHITE, RESET
+    colors = cycle(("blue", "cyan"))
+    for identifier in current_identifiers:
+        click.secho(_dumps(identifier), fg=next(colors))
 
 
 @identifiers.command("add")
@@ -268,42 +458,7 @@ def add_identifier(identifier: str, pid: str):
         invenio repository rdmrecords identifiers add -p "fcze8-4vx33"
         -i '{ "identifier": "10.48436/fcze8-4vx33", "scheme": "doi"}'
     """
-    try:
-        identifier_json = json.loads(identifier)
-    except Exception as e:
-        click.secho(e.msg, fg="red")
-        click.secho(f"identifier is not valid JSON", fg="red")
-        return
-
-    if not record_exists(pid):
-        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
-        return
-
-    identity = get_identity("system_process", role_name="admin")
-    service = get_records_service()
-    record_data = service.read(id_=pid, identity=identity).data.copy()
-
-    current_identifiers = record_data["metadata"].get("identifiers", [])
-    current_schemes = [_["scheme"] for _ in current_identifiers]
-    scheme = identifier_json["scheme"]
-    if scheme in current_schemes:
-        click.secho(f"scheme '{scheme}' already in identifiers", fg="red")
-        return
-
-    old_data = record_data.copy()
-    current_identifiers.append(identifier_json)
-    record_data["metadata"]["identifiers"] = current_identifiers
-
-    try:
-        update_record(
-            pid=pid, identity=identity, new_data=record_data, old_data=old_data
-        )
-    except Exception as e:
-        click.secho(f"'{pid}', Error during update, {e}", fg="red")
-        return
-
-    click.secho(f"Identifier for '{pid}' added.", fg="green")
-    return
+    _update_identifiers(pid, identifier, mode="add")
 
 
 @identifiers.command("replace")
@@ -317,42 +472,66 @@ def replace_identifier(identifier: str, pid: str):
         invenio repository rdmrecords identifiers replace -p "fcze8-4vx33"
         -i '{ "identifier": "10.48436/fcze8-4vx33", "scheme": "doi"}'
     """
+    _update_identifiers(pid, identifier, mode="replace")
+
+
+def _update_identifiers(pid: str, identifier: str, mode: str):
+    """Add or replace an identifier of a record.
+
+    mode is either "add" (the scheme must not be in the identifiers yet) or
+    "replace" (the first identifier with the same scheme is replaced).
+    """
+    from .util import get_identity, get_record_data, update_record
+
     try:
-        identifier_json = json.loads(identifier)
-    except Exception as e:
+        identifier_json = _loads(identifier)
+    except json.JSONDecodeError as e:
         click.secho(e.msg, fg="red")
         click.secho(f"identifier is not valid JSON", fg="red")
         return
 
-    if not record_exists(pid):
-        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
+    is_object = isinstance(identifier_json, dict)
+    if not is_object or "scheme" not in identifier_json:
+        click.secho("identifier has to be an object with a scheme", fg="red")
         return
 
     identity = get_identity("system_process", role_name="admin")
-    service = get_records_service()
-    record_data = service.read(id_=pid, identity=identity).data.copy()
-    current_identifiers = record_data["metadata"].get("identifiers", [])
-    scheme = identifier_json["scheme"]
-    replaced = False
-    for index, ci in enumerate(current_identifiers):
-        if ci["scheme"] == scheme:
-            current_identifiers[index] = identifier_json
-            replaced = True
-            break
-
-    if not replaced:
-        click.secho(f"scheme '{scheme}' not in identifiers", fg="red")
+    old_data = get_record_data(pid, identity=identity)
+    if old_data is None:
+        click.secho(f"'{pid}', does not exist or is deleted", fg="red")
         return
 
-    old_data = record_data.copy()
-    record_data["metadata"]["identifiers"] = current_identifiers
+    current_identifiers = old_data["metadata"].get("identifiers", [])
+    # map each scheme to the index of its first identifier
+    scheme_indices = {
+        ci["scheme"]: index
+        for index, ci in reversed(list(enumerate(current_identifiers)))
+    }
+    scheme = identifier_json["scheme"]
+    index = scheme_indices.get(scheme)
+
+    new_identifiers = list(current_identifiers)
+    if mode == "add":
+        if index is not None:
+            click.secho(f"scheme '{scheme}' already in identifiers", fg="red")
+            return
+        new_identifiers.append(identifier_json)
+    else:
+        if index is None:
+            click.secho(f"scheme '{scheme}' not in identifiers", fg="red")
+            return
+        new_identifiers[index] = identifier_json
+
+    new_metadata = {**old_data["metadata"], "identifiers": new_identifiers}
+    new_data = {**old_data, "metadata": new_metadata}
 
     try:
         update_record(
-            pid=pid, identity=identity, new_data=record_data, old_data=old_data
+            pid=pid, identity=identity, new_data=new_data, old_data=old_data
         )
     except Exception as e:
         click.secho(f"'{pid}', problem during update, {e}", fg="red")
         return
 
-    click.secho(f"Identifier for '{pid}' replaced.", fg="green")
+    action = "added" if mode == "add" else "replaced"
+    click.secho(f"Identifier for '{pid}' {action}.", fg="green")
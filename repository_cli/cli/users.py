@@ -9,7 +9,6 @@
 
 import click
 from flask.cli import with_appcontext
-from invenio_accounts.models import User
 
 
 @click.group()
@@ -26,10 +25,30 @@ def list_users():
     example call:
         invenio repository users list
     """
-    users = User.query
-
-    for user in users:
-        line = "{} {}".format(user.id, user.email)
-
-        fg = "green" if user.active else "red"
-        click.secho(line, fg=fg)
+    from invenio_accounts.models import User
+    from invenio_db import db
+
+    # only the needed columns are selected and streamed from a server side
+    # cursor, instead of loading all users as ORM objects at once
+    users = (
+        db.session.query(User.id, User.email, User.active)
+        .order_by(User.id)
+        .execution_options(stream_results=True)
+        .yield_per(1000)
+    )
+
+    # the colored templates are built once and the lines are echoed in
+    # chunks, instead of styling and echoing every line on its own
+    templates = {
+        True: click.style("{} {}", fg="green"),
+        False: click.style("{} {}", fg="red"),
+    }
+    lines = []
+    for user_id, email, active in users:
+        lines.append(templates[bool(active)].format(user_id, email))
+        if len(lines) >= 1000:
+            click.echo("\n".join(lines))
+            lines.clear()
+
+    if lines:
+        click.echo("\n".join(lines))
@@ -7,24 +7,71 @@
 
 """Commonly used utility functions."""
 
+from functools import wraps
+from typing import Optional
+
+from elasticsearch.exceptions import ConnectionError as SearchConnectionError
+from flask import g
 from flask_principal import Identity, RoleNeed
 from invenio_access.permissions import any_user, system_process
 from invenio_accounts import current_accounts
-from invenio_admin.permissions import action_admin_access
-from invenio_drafts_resources.records.api import Draft
+from invenio_db import db
+from invenio_pidstore.errors import PersistentIdentifierError
+from invenio_pidstore.models import PersistentIdentifier
 from invenio_rdm_records.proxies import current_rdm_records
+from invenio_rdm_records.records.models import RDMRecordMetadata
 from invenio_rdm_records.services import RDMRecordService
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm.exc import NoResultFound
+
+# permissions that can be provided by identities of get_identity
+_PERMISSIONS = {"any_user": any_user, "system_process": system_process}
+
+# pid type the pid provider of RDM records registers the record ids with
+_RECORD_PID_TYPE = "recid"
+
+RECORD_NOT_FOUND_ERRORS = (PersistentIdentifierError, NoResultFound)
+"""Errors raised by the records service if a record can not be resolved.
+
+PersistentIdentifierError is the base of all pid errors, e.g. of a pid
+which does not exist, is deleted or is not registered yet (draft only).
+"""
+
+TRANSIENT_ERRORS = (SearchConnectionError, OperationalError)
+"""Errors of an unavailable search index or database.
+
+They don't reject the new data of an update, so the draft is left as is.
+"""
 
 
+def app_context_cache(func):
+    """Cache the results of func for the lifetime of the app context.
+
+    Each CLI command runs in its own application context, so the cached
+    values are resolved at most once per command invocation and are never
+    shared between applications.
+    """
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        cache = g.setdefault("_repository_cli_cache", {})
+        key = (func.__qualname__, args, frozenset(kwargs.items()))
+        if key not in cache:
+            cache[key] = func(*args, **kwargs)
+        return cache[key]
+
+    return wrapper
+
+
+@app_context_cache
 def get_identity(permission_name: str = "any_user", role_name: str = None):
     """Get an identity to perform tasks.
 
     Default permission is "any_user"
+    The identity is cached per app context, it must not be modified.
     """
     identity = Identity(0)
-    permission = any_user
-    if permission_name == "system_process":
-        permission = system_process
+    permission = _PERMISSIONS.get(permission_name, any_user)
 
     if role_name:
         role = current_accounts.datastore.find_role(role_name)
@@ -37,53 +84,80 @@ def get_identity(permission_name: str = "any_user", role_name: str = None):
     return identity
 
 
-def get_draft(pid: str, identity: Identity) -> Draft:
-    """Get current draft of record.
-
-    None will be returned if there is no draft.
-    """
-    service = get_records_service()
-    # check if record exists
-    service.read(id_=pid, identity=identity)
-    draft = None
-    try:
-        draft = service.read_draft(id_=pid, identity=identity)
-    except Exception:
-        pass
-
-    return draft
-
-
+@app_context_cache
 def get_records_service() -> RDMRecordService:
     """Get records service."""
     return current_rdm_records.records_service
 
 
-def update_record(pid: str, identity: Identity, new_data, old_data):
+def update_record(
+    pid: str,
+    identity: Identity,
+    new_data,
+    old_data,
+    service: RDMRecordService = None,
+):
     """Update record with new data.
 
-    If there is an error during publishing, the record will be set back
+    If the update or publish fails, the draft will be set back to old_data,
+    so the rejected data is not picked up by the next edit. Transient errors
+    (TRANSIENT_ERRORS, e.g. a search index timeout) are raised without
+    another write to the draft.
     WARNING: If there is an unpublished draft, the data of it will be lost.
     """
-    service = get_records_service()
-    if not get_draft(pid, identity):
-        service.edit(id_=pid, identity=identity)
+    service = service or get_records_service()
+    # edit returns the existing draft if there is one, so there is no need
+    # to look it up beforehand
+    service.edit(id_=pid, identity=identity)
 
     try:
         service.update_draft(id_=pid, identity=identity, data=new_data)
         service.publish(id_=pid, identity=identity)
-    except Exception as e:
+    except TRANSIENT_ERRORS:
+        raise
+    except Exception:
         service.update_draft(id_=pid, identity=identity, data=old_data)
-        raise e
+        raise
 
 
-def record_exists(pid: str) -> bool:
-    """Check if record exists and is not deleted."""
-    service = get_records_service()
-    identity = get_identity()
+def get_record_data(
+    pid: str, identity: Identity, service: RDMRecordService = None
+) -> Optional[dict]:
+    """Get data of record.
+
+    None will be returned if the record does not exist or is deleted.
+    """
+    service = service or get_records_service()
     try:
-        service.read(id_=pid, identity=identity)
-    except Exception:
-        return False
+        return service.read(id_=pid, identity=identity).data
+    except RECORD_NOT_FOUND_ERRORS:
+        return None
 
-    return True
+
+def get_existing_pids(pids: list, chunk_size: int = 500) -> set:
+    """Get the subset of pids whose records exist and are not deleted.
+
+    The lookup is done with one query per chunk of pids instead of one
+    query per pid. Duplicated pids are only looked up once. The result is
+    not cached beyond the call, as records may be deleted in the meantime.
+    """
+    pids = list(dict.fromkeys(pids))
+    existing_pids = set()
+    for start in range(0, len(pids), chunk_size):
+        query = (
+            db.session.query(PersistentIdentifier.pid_value)
+            .join(
+                RDMRecordMetadata,
+                RDMRecordMetadata.id == PersistentIdentifier.object_uuid,
+            )
+            .filter(
+                PersistentIdentifier.pid_type == _RECORD_PID_TYPE,
+                PersistentIdentifier.pid_value.in_(
+                    pids[start:start + chunk_size]
+                ),
+                RDMRecordMetadata.is_deleted.is_(False),
+            )
+        )
+        existing_pids.update(pid_value for (pid_value,) in query)
+
+    return existing_pids
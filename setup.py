@@ -35,6 +35,8 @@ extras_require = {
         "Sphinx>=3",
         "sphinx-click>=2.5.0"
     ],
+    "ijson": ["ijson>=3.1"],
+    "orjson": ["orjson>=3.6.0"],
     "tests": tests_require,
 }
 
@@ -73,6 +73,45 @@ def test_list_output_file(app_initialized):
     assert f"wrote {len(records)} records to {filename}" in response.output
 
 
+def test_list_output_file_pretty(app_initialized, tmp_path):
+    # a fresh file, so a stale out.json can not satisfy the assertions
+    filename = str(tmp_path / "out.json")
+    runner = app_initialized["app"].test_cli_runner()
+    response = runner.invoke(list_records, ["--of", filename])
+    assert response.exit_code == 0
+    with open(filename) as fp:
+        compact = fp.read()
+    response = runner.invoke(list_records, ["--of", filename, "--pretty"])
+    assert response.exit_code == 0
+    with open(filename) as fp:
+        pretty = fp.read()
+    assert json.loads(compact) == json.loads(pretty)
+    assert len(compact) < len(pretty)
+
+
+def test_list_output_file_ndjson(app_initialized, tmp_path):
+    filename = str(tmp_path / "out.json")
+    records = app_initialized["data"]["rdmrecords"]
+    runner = app_initialized["app"].test_cli_runner()
+    response = runner.invoke(
+        list_records, ["--of", filename, "--format", "ndjson"]
+    )
+    assert response.exit_code == 0
+    with open(filename) as fp:
+        lines = fp.read().splitlines()
+    assert len(lines) == len(records)
+    assert {json.loads(line)["id"] for line in lines} == {
+        record.id for record in records
+    }
+
+
+def test_list_ndjson_pretty(app):
+    runner = app.test_cli_runner()
+    response = runner.invoke(list_records, ["--format", "ndjson", "--pretty"])
+    assert response.exit_code == 2
+    assert "--pretty can not be used with --format ndjson" in response.output
+
+
 def test_update(app_initialized):
     filename = "out.json"
     records = app_initialized["data"]["rdmrecords"]
@@ -87,6 +126,51 @@ def test_update(app_initialized):
     assert "successfully updated" in response.output
 
 
+def _list_to_file(runner, tmp_path):
+    """List the records into a fresh file and return its name."""
+    filename = str(tmp_path / "out.json")
+    response = runner.invoke(list_records, ["--of", filename])
+    assert response.exit_code == 0
+    return filename
+
+
+# with in-memory SQLite all threads share one connection and transaction
+@pytest.mark.skipif(
+    os.getenv("SQLALCHEMY_DATABASE_URI", "sqlite://").startswith("sqlite"),
+    reason="needs a database server to update in parallel threads",
+)
+def test_update_parallel(app_initialized, tmp_path):
+    records = app_initialized["data"]["rdmrecords"]
+    runner = app_initialized["app"].test_cli_runner()
+    filename = _list_to_file(runner, tmp_path)
+
+    response = runner.invoke(update_records, ["--if", filename, "-w", "2"])
+    assert response.exit_code == 0
+    assert response.output.count("successfully updated") == len(records)
+
+
+def test_update_record_not_found(app_initialized, tmp_path):
+    records = app_initialized["data"]["rdmrecords"]
+    deleted_id = records[0].id
+    unknown_id = "this does not exist"
+    runner = app_initialized["app"].test_cli_runner()
+    filename = _list_to_file(runner, tmp_path)
+    response = runner.invoke(delete_record, ["--pid", deleted_id])
+    assert response.exit_code == 0
+
+    with open(filename) as fp:
+        records_json = json.load(fp)
+    records_json.append({**records_json[-1], "id": unknown_id})
+    with open(filename, "w") as fp:
+        json.dump(records_json, fp)
+
+    response = runner.invoke(update_records, ["--if", filename])
+    assert response.exit_code == 0
+    assert f"'{deleted_id}', does not exist or is deleted" in response.output
+    assert f"'{unknown_id}', does not exist or is deleted" in response.output
+    assert response.output.count("successfully updated") == len(records) - 1
+
+
 def test_update_ill_formatted_file(app_initialized):
     filename = "out.json"
     f = open(filename, mode="w")
@@ -99,6 +183,35 @@ def test_update_ill_formatted_file(app_initialized):
     assert "The input file is not a valid JSON File" in response.output
 
 
+def test_update_streamed(app_initialized, monkeypatch, tmp_path):
+    pytest.importorskip("ijson")
+    monkeypatch.setattr("repository_cli.cli.records._STREAM_INPUT_SIZE", 0)
+    records = app_initialized["data"]["rdmrecords"]
+    runner = app_initialized["app"].test_cli_runner()
+    filename = _list_to_file(runner, tmp_path)
+
+    response = runner.invoke(update_records, ["--if", filename])
+    assert response.exit_code == 0
+    assert response.output.count("successfully updated") == len(records)
+
+
+def test_update_streamed_truncated_file(
+    app_initialized, monkeypatch, tmp_path
+):
+    pytest.importorskip("ijson")
+    monkeypatch.setattr("repository_cli.cli.records._STREAM_INPUT_SIZE", 0)
+    runner = app_initialized["app"].test_cli_runner()
+    filename = _list_to_file(runner, tmp_path)
+    with open(filename) as fp:
+        content = fp.read()
+    with open(filename, "w") as fp:
+        fp.write(content[:len(content) // 2])
+
+    response = runner.invoke(update_records, ["--if", filename])
+    assert response.exit_code == 0
+    assert "The input file is not a valid JSON File" in response.output
+
+
 def test_delete(app_initialized):
     records = app_initialized["data"]["rdmrecords"]
     r_id = records[0].id
@@ -106,3 +219,11 @@ def test_delete(app_initialized):
     response = runner.invoke(delete_record, ["--pid", r_id])
     assert response.exit_code == 0
     assert f"'{r_id}', soft-deleted" in response.output
+
+
+def test_delete_record_not_found(app_initialized):
+    runner = app_initialized["app"].test_cli_runner()
+    r_id = "this does not exist"
+    response = runner.invoke(delete_record, ["--pid", r_id])
+    assert response.exit_code == 0
+    assert f"'{r_id}', does not exist or is deleted" in response.output
@@ -81,6 +81,17 @@ def test_add_identifier_wrong_identifier_type(app_initialized):
     assert "identifier is not valid JSON" in response.output
 
 
+def test_add_identifier_without_scheme(app_initialized):
+    runner = app_initialized["app"].test_cli_runner()
+    records = app_initialized["data"]["rdmrecords"]
+    r_id = records[0].id
+    response = runner.invoke(
+        add_identifier, ["--pid", r_id, "--identifier", '["doi"]']
+    )
+    assert response.exit_code == 0
+    assert "identifier has to be an object with a scheme" in response.output
+
+
 def test_add_identifiers_record_not_found(app_initialized, identifier):
     runner = app_initialized["app"].test_cli_runner()
     r_id = "this does not exist"
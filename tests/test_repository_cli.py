@@ -7,6 +7,9 @@
 
 """Module tests."""
 
+import subprocess
+import sys
+
 from flask import Flask
 
 from repository_cli import RepositoryCli
@@ -30,3 +33,15 @@ def test_init():
     assert "repository-cli" not in app.extensions
     ext.init_app(app)
     assert "repository-cli" in app.extensions
+
+
+def test_cli_import_does_not_load_invenio():
+    """Test that loading the commands, e.g. for completion, is lightweight."""
+    code = (
+        "import sys, repository_cli.cli; "
+        "print([m for m in sys.modules if m.startswith('invenio')])"
+    )
+    output = subprocess.check_output(
+        [sys.executable, "-c", code], universal_newlines=True
+    )
+    assert output.strip() == "[]"
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2021 Graz University of Technology.
+#
+# repository-cli is free software; you can redistribute it and/or modify it
+# under the terms of the MIT License; see LICENSE file for more details.
+
+"""Utility function tests."""
+
+import pytest
+from elasticsearch.exceptions import ConnectionError as SearchConnectionError
+from jsonschema.exceptions import ValidationError
+
+from repository_cli.cli.util import (get_identity, get_records_service,
+                                     update_record)
+
+
+def _update_record_with_failing_publish(app_initialized, monkeypatch, error):
+    """Update the title of a record, publish raises error."""
+    records = app_initialized["data"]["rdmrecords"]
+    pid = records[0].id
+    identity = get_identity(
+        permission_name="system_process", role_name="admin"
+    )
+    service = get_records_service()
+    old_data = service.read(id_=pid, identity=identity).data
+    new_data = {
+        **old_data,
+        "metadata": {**old_data["metadata"], "title": "rejected title"},
+    }
+
+    def publish(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(service, "publish", publish)
+    with pytest.raises(type(error)):
+        update_record(
+            pid=pid,
+            identity=identity,
+            new_data=new_data,
+            old_data=old_data,
+            service=service,
+        )
+
+    draft = service.read_draft(id_=pid, identity=identity)
+    return old_data, draft.data
+
+
+def test_update_record_rolls_back_rejected_data(app_initialized, monkeypatch):
+    """Test that rejected data is not left in the draft."""
+    old_data, draft_data = _update_record_with_failing_publish(
+        app_initialized, monkeypatch, ValidationError("invalid record")
+    )
+    assert draft_data["metadata"]["title"] == old_data["metadata"]["title"]
+
+
+def test_update_record_keeps_draft_on_transient_error(
+    app_initialized, monkeypatch
+):
+    """Test that the draft is not written again on transient errors."""
+    old_data, draft_data = _update_record_with_failing_publish(
+        app_initialized, monkeypatch, SearchConnectionError("N/A", "timeout")
+    )
+    assert draft_data["metadata"]["title"] == "rejected title"